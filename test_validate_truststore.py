@@ -0,0 +1,80 @@
+'''
+Pruebas de fast_jks_certs contra keystores generados por pyjks (KeyStore.saves).
+
+  pip install pytest pyjks cryptography
+  python -m pytest -q
+'''
+import datetime
+
+import jks
+import pytest
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import Encoding, PrivateFormat, NoEncryption
+from jks.util import KeystoreSignatureException
+
+from validate_truststore import fast_jks_certs
+
+
+def make_cert(cn):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, cn)])
+    cert = (x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(datetime.datetime(2020, 1, 1))
+            .not_valid_after(datetime.datetime(2040, 1, 1))
+            .sign(key, hashes.SHA256()))
+    return key, cert.public_bytes(Encoding.DER)
+
+
+@pytest.fixture(scope='module')
+def certs():
+    return {alias: make_cert(alias) for alias in ('nosis', 'sectigo', 'usertrust')}
+
+
+def trusted_entries(certs):
+    return [jks.TrustedCertEntry.new(alias, der) for alias, (_, der) in certs.items()]
+
+
+def pyjks_certs(data, password):
+    return {alias: e.cert for alias, e in jks.KeyStore.loads(data, password).certs.items()}
+
+
+def test_round_trip_trusted_certs(certs):
+    data = jks.KeyStore.new('jks', trusted_entries(certs)).saves('changeit')
+    result = fast_jks_certs(data, 'changeit')
+    assert result == {alias: der for alias, (_, der) in certs.items()}
+    assert result == pyjks_certs(data, 'changeit')
+
+
+def test_private_key_entries_are_skipped(certs):
+    key, der = certs['nosis']
+    pkcs8 = key.private_bytes(Encoding.DER, PrivateFormat.PKCS8, NoEncryption())
+    entries = trusted_entries(certs) + [jks.PrivateKeyEntry.new('tomcat', [der], pkcs8)]
+    data = jks.KeyStore.new('jks', entries).saves('changeit')
+    result = fast_jks_certs(data, 'changeit')
+    assert 'tomcat' not in result
+    assert result == pyjks_certs(data, 'changeit')
+
+
+def test_wrong_password_raises(certs):
+    data = jks.KeyStore.new('jks', trusted_entries(certs)).saves('changeit')
+    with pytest.raises(KeystoreSignatureException):
+        fast_jks_certs(data, 'otra')
+
+
+@pytest.mark.parametrize('cut', [5, 30, 200, 1])
+def test_truncated_store_falls_back(certs, cut):
+    data = jks.KeyStore.new('jks', trusted_entries(certs)).saves('changeit')
+    assert fast_jks_certs(data[:-cut], 'changeit') is None
+
+
+def test_non_jks_magic_falls_back(certs):
+    # pyjks no puede escribir JCEKS: se cambia sólo el magic number
+    data = jks.KeyStore.new('jks', trusted_entries(certs)).saves('changeit')
+    assert fast_jks_certs(b'\xce\xce\xce\xce' + data[4:], 'changeit') is None
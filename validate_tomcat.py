@@ -15,15 +15,12 @@ Requisitos:
 import os
 import sys
 import ssl
-import socket
+import asyncio
 import argparse
-import tempfile
+from functools import lru_cache
 
 try:
     import jks
-    from cryptography import x509
-    from cryptography.hazmat.primitives.serialization import Encoding
-    from cryptography.hazmat.backends import default_backend
 except ImportError:
     print("Faltan dependencias: pip install pyjks cryptography")
     sys.exit(1)
@@ -37,63 +34,98 @@ def check_path(path, desc):
     return True
 
 
+@lru_cache(maxsize=4)
 def find_cacerts(jdk_home):
-    candidates = [
-        os.path.join(jdk_home, 'lib', 'security', 'jssecacerts'),
-        os.path.join(jdk_home, 'lib', 'security', 'cacerts'),
-        os.path.join(jdk_home, 'jre', 'lib', 'security', 'jssecacerts'),
-        os.path.join(jdk_home, 'jre', 'lib', 'security', 'cacerts'),
-    ]
-    for p in candidates:
-        if os.path.exists(p):
-            return p
+    # Un listdir por directorio en lugar de un stat por candidato (útil en SMB/NFS)
+    for sub in (('lib', 'security'), ('jre', 'lib', 'security')):
+        d = os.path.join(jdk_home, *sub)
+        try:
+            names = set(os.listdir(d))
+        except OSError:
+            continue
+        for name in ('jssecacerts', 'cacerts'):
+            if name in names:
+                return os.path.join(d, name)
     return None
 
 
-def extract_truststore(cacerts_path, password):
-    # Carga JKS truststore y exporta todos los certificados a un PEM temporal
-    ks = jks.KeyStore.loads(open(cacerts_path, 'rb').read(), password)
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix='.pem')
-    for alias, entry in ks.certs.items():
-        cert = x509.load_der_x509_certificate(entry.cert, default_backend())
-        tmp.write(cert.public_bytes(Encoding.PEM))
-    tmp.close()
-    return tmp.name
+def load_keystore(ks_path, password):
+    # Carga un keystore JKS/JCEKS leyendo el archivo una sola vez
+    # (pyjks no soporta PKCS12)
+    with open(ks_path, 'rb') as f:
+        data = f.read()
+    try:
+        return jks.KeyStore.loads(data, password)
+    except jks.util.KeystoreSignatureException:
+        print(f"ERROR: Contraseña incorrecta para {ks_path}")
+        sys.exit(1)
+    except jks.util.KeystoreException as ex:
+        print(f"ERROR: {ks_path} no es un keystore JKS/JCEKS válido: {ex}")
+        sys.exit(1)
+
 
+def truststore_cadata(ks):
+    # Certificados DER del truststore concatenados, para cargarlos en memoria
+    return b''.join(entry.cert for entry in ks.certs.values())
 
-def test_ssl_connection(host, port, cafile):
-    ctx = ssl.create_default_context(cafile=cafile)
+
+@lru_cache(maxsize=1)
+def build_ctx(cadata):
+    # El truststore se parsea una sola vez y el contexto se reutiliza entre hosts
+    return ssl.create_default_context(cadata=cadata)
+
+
+async def test_ssl_connection(host, port, ctx):
     try:
-        with socket.create_connection((host, port), timeout=5) as sock:
-            with ctx.wrap_socket(sock, server_hostname=host) as ssock:
-                peer = ssock.getpeercert()
-                print(f"SSL HANDSHAKE OK con {host}:{port}")
-                print(f"Certificado recibido:\n  Subject: {peer.get('subject')}")
-        return True
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=ctx, server_hostname=host), timeout=5)
+    except asyncio.TimeoutError:
+        print(f"ERROR SSL handshake con {host}:{port}: timed out")
+        return False
     except Exception as e:
         print(f"ERROR SSL handshake con {host}:{port}: {e}")
         return False
+    peer = writer.get_extra_info('peercert')
+    print(f"SSL HANDSHAKE OK con {host}:{port}\n"
+          f"Certificado recibido:\n  Subject: {peer.get('subject')}")
+    await close_writer(writer)
+    return True
 
 
-def inspect_keystore(ks_path, password):
-    # Determina tipo JKS o PKCS12
+async def close_writer(writer):
+    writer.close()
     try:
-        ks = jks.KeyStore.loads(open(ks_path, 'rb').read(), password)
-    except jks.util.DecryptionFailureException:
-        ks = jks.PKCS12KeyStore.loads(open(ks_path, 'rb').read(), password)
-    print(f"Aliases en keystore {ks_path}:")
-    for alias in ks.aliases:
-        print(f"  - {alias}")
-    return bool(ks.aliases)
+        await asyncio.wait_for(writer.wait_closed(), timeout=5)
+    except Exception:
+        pass
+
+
+async def probe_hosts(hosts, port, ctx):
+    # Los handshakes se solapan: el tiempo total es el del host más lento
+    return await asyncio.gather(*(test_ssl_connection(h, port, ctx) for h in hosts))
+
+
+def inspect_keystore(ks, ks_path):
+    # una sola escritura para todo el listado en lugar de un print() por alias
+    aliases = list(ks.entries)
+    sys.stdout.write(f"Aliases en keystore {ks_path}:\n"
+                     + ''.join(f"  - {alias}\n" for alias in aliases))
+    return bool(aliases)
+
+
+def split_args(values):
+    # Acepta valores separados por espacios (nargs='+') y también la forma
+    # anterior coma-separada ("a,b,c"), que sigue usando el .exe publicado
+    return [v.strip() for token in values for v in token.split(',') if v.strip()]
 
 
 def main():
     parser = argparse.ArgumentParser(description="Valida Tomcat/JDK SSL setup")
     parser.add_argument('--tomcat',   required=True, help='Directorio CATALINA_HOME')
     parser.add_argument('--jdk',      required=True, help='Directorio JAVA_HOME')
-    parser.add_argument('--keystore', help='Ruta a servidor keystore (JKS/PKCS12)')
+    parser.add_argument('--keystore', help='Ruta a servidor keystore (JKS/JCEKS)')
     parser.add_argument('--storepass', default='changeit', help='Password de truststore/keystore')
-    parser.add_argument('--host',     help='Host remoto a probar SSL')
+    parser.add_argument('--host',     nargs='+', default=[], help='Host(s) remoto(s) a probar SSL')
     parser.add_argument('--port',     type=int, default=443, help='Puerto remoto SSL')
     args = parser.parse_args()
 
@@ -109,17 +141,23 @@ def main():
     print(f"Usando truststore: {cacerts}")
 
     # 3) Inspeccionar keystore de Tomcat si se pasa
+    truststore = None
     if args.keystore:
         if check_path(args.keystore, 'Keystore Tomcat'):
-            if not inspect_keystore(args.keystore, args.storepass):
+            ks = load_keystore(args.keystore, args.storepass)
+            if not inspect_keystore(ks, args.keystore):
                 print("ERROR: Keystore no contiene alias válidos.")
                 sys.exit(1)
+            # si el keystore es el mismo cacerts, no volver a parsearlo
+            if os.path.samefile(args.keystore, cacerts):
+                truststore = ks
 
     # 4) Probar SSL remoto
     if args.host:
-        pem = extract_truststore(cacerts, args.storepass)
-        test_ssl_connection(args.host, args.port, cafile=pem)
-        os.unlink(pem)
+        if truststore is None:
+            truststore = load_keystore(cacerts, args.storepass)
+        hosts = split_args(args.host)
+        asyncio.run(probe_hosts(hosts, args.port, build_ctx(truststore_cadata(truststore))))
 
 if __name__ == '__main__':
     main()
@@ -3,10 +3,12 @@ validate_truststore.py
 
 Script para diagnosticar problemas de PKIX Path Building contra un servicio HTTPS:
  1. Localiza el `cacerts` del JDK usado por Tomcat.
- 2. Lista los aliases presentes en el truststore (JKS o PKCS12).
+ 2. Lista los aliases presentes en el truststore (JKS o JCEKS; PKCS12 no está soportado).
  3. Verifica que estén los certificados esperados (por alias o subject).
  4. Permite comprobar si archivos de certificados externos (.cer/.pem) están importados.
- 5. Extrae el truststore a PEM y prueba un handshake SSL contra el host remoto.
+ 5. Carga el truststore en memoria y prueba un handshake SSL contra uno o varios hosts remotos.
+ 6. Opcionalmente guarda la cadena que presenta el servidor (--chain-cache) y la
+    revalida offline contra el truststore (--recheck), sin volver a conectarse.
 
 Requisitos:
   pip install pyjks cryptography
@@ -15,111 +17,303 @@ Uso:
   python validate_truststore.py \
     --jdk "C:\Install_BT\openlogic-openjdk-17.0.13+11-windows-x64" \
     --storepass changeit \
-    --expected "nosis,sectigo,usertrust" \
-    --certfiles "nosis.cer,sectigo.cer,usertrust.cer" \
+    --expected nosis sectigo usertrust \
+    --certfiles nosis.cer sectigo.cer usertrust.cer \
     --host sac.nosis.com \
     --port 443
 '''
 import os
 import sys
 import ssl
-import socket
-import tempfile
+import asyncio
 import argparse
 import hashlib
+import mmap
+import re
+import struct
+from functools import lru_cache
 
 try:
     import jks
-    from jks.util import DecryptionFailureException, BadKeystoreFormatException
+    from jks.util import DecryptionFailureException, BadKeystoreFormatException, KeystoreSignatureException
     from cryptography import x509
     from cryptography.hazmat.primitives.serialization import Encoding
-    from cryptography.hazmat.backends import default_backend
 except ImportError:
     print("Faltan dependencias: pip install pyjks cryptography")
     sys.exit(1)
 
 
+@lru_cache(maxsize=4)
 def find_cacerts(jdk_home):
-    candidates = [
-        os.path.join(jdk_home, 'lib', 'security', 'jssecacerts'),
-        os.path.join(jdk_home, 'lib', 'security', 'cacerts'),
-        os.path.join(jdk_home, 'jre', 'lib', 'security', 'jssecacerts'),
-        os.path.join(jdk_home, 'jre', 'lib', 'security', 'cacerts'),
-    ]
-    for p in candidates:
-        if os.path.isfile(p):
-            return p
+    # Un listdir por directorio en lugar de un stat por candidato (útil en SMB/NFS)
+    for sub in (('lib', 'security'), ('jre', 'lib', 'security')):
+        d = os.path.join(jdk_home, *sub)
+        try:
+            names = set(os.listdir(d))
+        except OSError:
+            continue
+        for name in ('jssecacerts', 'cacerts'):
+            if name in names:
+                return os.path.join(d, name)
     return None
 
 
+def fast_jks_certs(data, password):
+    # Lee los certificados de confianza de un JKS v2 sin pyjks (sin ASN.1 ni
+    # descifrado de claves privadas, que se saltean). Devuelve {alias: der},
+    # o None si el formato no es soportado aquí (JCEKS, PKCS12, otros tags).
+    if data[:4] != b'\xfe\xed\xfe\xed':
+        return None
+    size = len(data)
+    try:
+        version, count = struct.unpack_from('>II', data, 4)
+        if version != 2:
+            return None
+        certs = {}
+        off = 12
+        for _ in range(count):
+            tag, alias_len = struct.unpack_from('>IH', data, off)
+            off += 6
+            alias = bytes(data[off:off + alias_len]).decode('utf-8')
+            off += alias_len + 8  # alias + timestamp
+            if tag == 1:
+                key_len, = struct.unpack_from('>I', data, off)
+                off += 4 + key_len
+                chain_len, = struct.unpack_from('>I', data, off)
+                off += 4
+                for _ in range(chain_len):
+                    type_len, = struct.unpack_from('>H', data, off)
+                    off += 2 + type_len
+                    cert_len, = struct.unpack_from('>I', data, off)
+                    off += 4 + cert_len
+            elif tag == 2:
+                type_len, = struct.unpack_from('>H', data, off)
+                off += 2 + type_len
+                cert_len, = struct.unpack_from('>I', data, off)
+                off += 4
+                if off + cert_len > size:  # truncado: que pyjks reporte el formato
+                    return None
+                certs[alias] = bytes(data[off:off + cert_len])
+                off += cert_len
+            else:
+                return None
+    except (struct.error, UnicodeDecodeError):
+        return None
+    if off + 20 > size:
+        return None
+    # integridad: SHA-1(password UTF-16BE + "Mighty Aphrodite" + contenido)
+    h = hashlib.sha1(password.encode('utf-16be') + b'Mighty Aphrodite')
+    with memoryview(data)[:off] as body:
+        h.update(body)
+    if h.digest() != data[off:off + 20]:
+        raise KeystoreSignatureException("Hash mismatch; incorrect keystore password?")
+    return certs
+
+
 def load_keystore(cacerts_path, password):
-    data = open(cacerts_path, 'rb').read()
+    # mmap: el parser rápido lee directo de la page cache sin copiar el archivo
+    with open(cacerts_path, 'rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                certs = fast_jks_certs(mm, password)
+                data = None if certs is not None else mm[:]
+        except KeystoreSignatureException:
+            print(f"ERROR: Contraseña incorrecta para {cacerts_path}")
+            sys.exit(1)
+        except (ValueError, OSError):
+            # archivo vacío o filesystem sin soporte de mmap (algunos SMB/NFS/FUSE)
+            certs, data = None, f.read()
+    if certs is not None:
+        return jks.KeyStore('jks', {
+            alias: jks.TrustedCertEntry(alias=alias, cert=der, type='X.509', store_type='jks')
+            for alias, der in certs.items()
+        })
     try:
         return jks.KeyStore.loads(data, password)
-    except DecryptionFailureException:
+    except (DecryptionFailureException, KeystoreSignatureException):
         print(f"ERROR: Contraseña incorrecta para {cacerts_path}")
         sys.exit(1)
-    except BadKeystoreFormatException:
-        try:
-            return jks.PKCS12KeyStore.loads(data, password)
-        except Exception as ex:
-            print(f"ERROR: No es un keystore JKS o PKCS12 válido: {ex}")
-            sys.exit(1)
+    except BadKeystoreFormatException as ex:
+        # pyjks no soporta PKCS12 (no existe jks.PKCS12KeyStore)
+        print(f"ERROR: No es un keystore JKS/JCEKS válido: {ex}")
+        print("       PKCS12 no está soportado (es el formato de cacerts desde JDK 18); "
+              "convertirlo a JKS con keytool -importkeystore -deststoretype JKS")
+        sys.exit(1)
 
 
 def list_aliases(ks):
     if hasattr(ks, 'certs'):
-        return list(ks.certs.keys())
+        return list(ks.certs)
     # PKCS12KeyStore may use .entries
     return [e.alias for e in getattr(ks, 'entries', [])]
 
 
-def extract_truststore_pem(ks, password):
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix='.pem')
-    if hasattr(ks, 'certs'):
-        entries = ks.certs.values()
-    else:
-        entries = [e.cert for e in ks.certs.values()] if hasattr(ks, 'certs') else []
-    for entry in entries:
-        cert = x509.load_der_x509_certificate(entry.cert if hasattr(entry, 'cert') else entry, default_backend())
-        tmp.write(cert.public_bytes(Encoding.PEM))
-    tmp.close()
-    return tmp.name
+def truststore_cadata(ks):
+    # Certificados DER del truststore concatenados, para cargarlos en memoria
+    certs = getattr(ks, 'certs', {})
+    return b''.join(entry.cert for entry in certs.values())
 
 
 def compute_fingerprint(cert_path):
-    data = open(cert_path, 'rb').read()
-    # soporta DER (.cer) o PEM
-    try:
-        cert = x509.load_pem_x509_certificate(data, default_backend())
-    except ValueError:
-        cert = x509.load_der_x509_certificate(data, default_backend())
-    der = cert.public_bytes(Encoding.DER)
-    sha256 = hashlib.sha256(der).hexdigest().upper()
-    return ':'.join(sha256[i:i+2] for i in range(0, len(sha256), 2)), cert.subject.rfc4514_string()
+    with open(cert_path, 'rb') as f:
+        data = f.read()
+    # soporta DER (.cer) o PEM (con o sin texto previo, p.ej. "Bag Attributes");
+    # un DER ya es la codificación a hashear
+    if b'-----BEGIN CERTIFICATE-----' in data:
+        cert = x509.load_pem_x509_certificate(data)
+        der = cert.public_bytes(Encoding.DER)
+    else:
+        cert = x509.load_der_x509_certificate(data)
+        der = data
+    return hashlib.sha256(der).digest(), cert.subject.rfc4514_string()
 
 
-def test_ssl_connection(host, port, cafile):
-    ctx = ssl.create_default_context(cafile=cafile)
+@lru_cache(maxsize=1)
+def build_ctx(cadata):
+    # El truststore se parsea una sola vez y el contexto se reutiliza entre hosts
+    return ssl.create_default_context(cadata=cadata)
+
+
+async def test_ssl_connection(host, port, ctx, cache_dir=None):
     try:
-        with socket.create_connection((host, port), timeout=5) as sock:
-            with ctx.wrap_socket(sock, server_hostname=host):
-                pass
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=ctx, server_hostname=host), timeout=5)
+    except asyncio.TimeoutError:
+        print(f"❌ ERROR SSL handshake contra {host}:{port}: timed out")
+    except Exception as e:
+        print(f"❌ ERROR SSL handshake contra {host}:{port}: {e}")
+    else:
         print(f"✅ SSL handshake OK contra {host}:{port}")
+        if cache_dir:
+            # la cadena se toma de esta misma conexión verificada
+            save_chain(host, port, cache_dir, peer_chain_der(writer.get_extra_info('ssl_object')))
+        await close_writer(writer)
         return True
+    if cache_dir:
+        await cache_chain(host, port, cache_dir)
+    return False
+
+
+async def close_writer(writer):
+    writer.close()
+    try:
+        await asyncio.wait_for(writer.wait_closed(), timeout=5)
+    except Exception:
+        pass
+
+
+def peer_chain_der(ssl_object):
+    # get_unverified_chain es público desde Python 3.13; en 3.10-3.12 sólo existe
+    # en el objeto interno. Sin él, sólo se puede obtener el certificado hoja.
+    if hasattr(ssl_object, 'get_unverified_chain'):
+        return list(ssl_object.get_unverified_chain())
+    inner = getattr(ssl_object, '_sslobj', None)
+    if hasattr(inner, 'get_unverified_chain'):
+        chain = inner.get_unverified_chain() or []
+        if chain:
+            return [c.public_bytes(ssl._ssl.ENCODING_DER) for c in chain]
+    return [ssl_object.getpeercert(binary_form=True)]
+
+
+def chain_cache_path(cache_dir, host, port):
+    # El host se sanea: IPv6 (::1) no es un nombre válido en Windows y
+    # '/' o '\' permitirían salir del directorio de cache
+    safe_host = re.sub(r'[^A-Za-z0-9.-]', '_', host)
+    return os.path.join(cache_dir, f"{safe_host}_{port}.pem")
+
+
+def save_chain(host, port, cache_dir, chain):
+    path = chain_cache_path(cache_dir, host, port)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(''.join(ssl.DER_cert_to_PEM_cert(der) for der in chain))
+    print(f"Cadena de {host}:{port} ({len(chain)} certificados) guardada en {path}")
+
+
+@lru_cache(maxsize=1)
+def build_unverified_ctx():
+    # Sin verificación ni CAs del sistema: sólo sirve para capturar la cadena
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
+async def cache_chain(host, port, cache_dir):
+    # Handshake sin verificar, sólo cuando falló el verificado: la cadena se
+    # quiere capturar justamente cuando falla PKIX
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=build_unverified_ctx(), server_hostname=host),
+            timeout=5)
+    except asyncio.TimeoutError:
+        print(f"⚠️  No se pudo capturar la cadena de {host}:{port}: timed out")
+        return False
+    except Exception as e:
+        print(f"⚠️  No se pudo capturar la cadena de {host}:{port}: {e}")
+        return False
+    save_chain(host, port, cache_dir, peer_chain_der(writer.get_extra_info('ssl_object')))
+    await close_writer(writer)
+    return True
+
+
+async def probe_hosts(hosts, port, ctx, cache_dir=None):
+    # Los handshakes se solapan: el tiempo total es el del host más lento
+    return await asyncio.gather(*(test_ssl_connection(h, port, ctx, cache_dir) for h in hosts))
+
+
+def build_x509_store(ks, verify_flags):
+    # Store de OpenSSL (pyOpenSSL) con el truststore, armado una sola vez para todos
+    # los hosts. Usa los mismos flags de verificación que el contexto del handshake.
+    try:
+        from OpenSSL import crypto
+    except ImportError:
+        print("ERROR: --recheck requiere pyOpenSSL (pip install pyopenssl)")
+        sys.exit(1)
+    store = crypto.X509Store()
+    for entry in getattr(ks, 'certs', {}).values():
+        store.add_cert(crypto.X509.from_cryptography(x509.load_der_x509_certificate(entry.cert)))
+    store.set_flags(int(verify_flags))
+    return store
+
+
+def recheck_chain(host, port, cache_dir, store):
+    # Revalida offline (sin red ni handshake) la ruta PKIX de la cadena guardada con
+    # las reglas de OpenSSL, las mismas del handshake real. No verifica el hostname.
+    from OpenSSL import crypto
+    path = chain_cache_path(cache_dir, host, port)
+    if not os.path.isfile(path):
+        print(f"❌ No hay cadena guardada para {host}:{port} ({path})")
+        return False
+    try:
+        with open(path, 'rb') as f:
+            leaf, *intermediates = [crypto.X509.from_cryptography(c)
+                                    for c in x509.load_pem_x509_certificates(f.read())]
+        crypto.X509StoreContext(store, leaf, chain=intermediates).verify_certificate()
     except Exception as e:
-        print(f"❌ ERROR SSL handshake: {e}")
+        print(f"❌ ERROR validación offline contra {host}:{port}: {e}")
         return False
+    print(f"✅ Validación offline OK contra {host}:{port} (cadena de {path})")
+    return True
+
+
+def split_args(values):
+    # Acepta valores separados por espacios (nargs='+') y también la forma
+    # anterior coma-separada ("a,b,c"), que sigue usando el .exe publicado
+    return [v.strip() for token in values for v in token.split(',') if v.strip()]
 
 
 def main():
     parser = argparse.ArgumentParser(description="Diagnóstico de PKIX con cacerts de Java.")
     parser.add_argument('--jdk',        required=True, help='Directorio JAVA_HOME')
     parser.add_argument('--storepass',  default='changeit', help='Password del cacerts')
-    parser.add_argument('--expected',   help='Aliases esperados en cacerts (coma-separados)')
-    parser.add_argument('--certfiles',  help='Archivos de certificados externos (.cer/.pem)')
-    parser.add_argument('--host',       help='Host remoto a probar SSL')
+    parser.add_argument('--expected',   nargs='+', default=[], help='Aliases esperados en cacerts')
+    parser.add_argument('--certfiles',  nargs='+', default=[], help='Archivos de certificados externos (.cer/.pem)')
+    parser.add_argument('--host',       nargs='+', default=[], help='Host(s) remoto(s) a probar SSL')
     parser.add_argument('--port',       type=int, default=443, help='Puerto remoto SSL')
+    parser.add_argument('--chain-cache', help='Directorio donde guardar/leer la cadena presentada por cada host')
+    parser.add_argument('--recheck',    action='store_true',
+                        help='Revalidar offline (reglas OpenSSL, sin hostname) la cadena guardada en --chain-cache, sin conectarse')
     args = parser.parse_args()
 
     # 1) Encontrar cacerts
@@ -134,13 +328,14 @@ def main():
 
     # 3) Listar aliases
     aliases = list_aliases(ks)
-    print(f"Aliases en cacerts ({len(aliases)}):")
-    for a in aliases:
-        print(f"  - {a}")
+    # una sola escritura para todo el listado en lugar de un print() por alias
+    sys.stdout.write(f"Aliases en cacerts ({len(aliases)}):\n"
+                     + ''.join(f"  - {a}\n" for a in aliases))
 
     # 4) Verificar aliases esperados
     if args.expected:
-        missing = [e for e in args.expected.split(',') if e not in aliases]
+        alias_set = set(aliases)
+        missing = [e for e in split_args(args.expected) if e not in alias_set]
         if missing:
             print(f"\n⚠️  Faltan estos alias en cacerts: {', '.join(missing)}")
         else:
@@ -149,33 +344,34 @@ def main():
     # 5) Verificar archivos de certificados externos
     if args.certfiles:
         print("\nValidando archivos de certificados externos:")
-        for path in args.certfiles.split(','):
-            path = path.strip()
+        # huellas SHA-256 (crudas) de cada alias, una sola vez; entry.cert ya es DER
+        alias_fps = {hashlib.sha256(e.cert).digest() for e in getattr(ks, 'certs', {}).values()}
+        report = []
+        for path in split_args(args.certfiles):
             if not os.path.isfile(path):
-                print(f"ERROR: No existe el certificado {path}")
+                report.append(f"ERROR: No existe el certificado {path}\n")
                 continue
-            fp, subj = compute_fingerprint(path)
-            found = False
-            for alias in aliases:
-                # obtener huella de cada alias
-                entry = ks.certs.get(alias) if hasattr(ks, 'certs') else None
-                der = entry.cert if entry else None
-                if der:
-                    cert = x509.load_der_x509_certificate(der, default_backend())
-                    der_fp = hashlib.sha256(cert.public_bytes(Encoding.DER)).hexdigest().upper()
-                    der_fp_formatted = ':'.join(der_fp[i:i+2] for i in range(0, len(der_fp), 2))
-                    if der_fp_formatted == fp:
-                        found = True
-                        break
-            print(f"  {path}: {'✅ importado' if found else '❌ no encontrado'} (Subject: {subj})")
+            try:
+                fp, subj = compute_fingerprint(path)
+            except ValueError as ex:
+                report.append(f"ERROR: No se pudo leer el certificado {path}: {ex}\n")
+                continue
+            found = fp in alias_fps
+            report.append(f"  {path}: {'✅ importado' if found else '❌ no encontrado'} (Subject: {subj})\n")
+        sys.stdout.write(''.join(report))
 
     # 6) Probar handshake SSL
     if args.host:
-        pem = extract_truststore_pem(ks, args.storepass)
-        try:
-            test_ssl_connection(args.host, args.port, cafile=pem)
-        finally:
-            os.unlink(pem)
+        hosts = split_args(args.host)
+        if args.recheck:
+            if not args.chain_cache:
+                print("ERROR: --recheck requiere --chain-cache")
+                sys.exit(1)
+            store = build_x509_store(ks, build_ctx(truststore_cadata(ks)).verify_flags)
+            for h in hosts:
+                recheck_chain(h, args.port, args.chain_cache, store)
+        else:
+            asyncio.run(probe_hosts(hosts, args.port, build_ctx(truststore_cadata(ks)), args.chain_cache))
 
 if __name__ == '__main__':
     main()